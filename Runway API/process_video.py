@@ -8,6 +8,7 @@ def download_video(url, filename):
     filepath = os.path.join("Result", filename)
     print(f"📥 Downloading: {url}")
     response = requests.get(url, stream=True)
+    response.raise_for_status()
     with open(filepath, 'wb') as f:
         for chunk in response.iter_content(chunk_size=8192):
             f.write(chunk)
@@ -22,7 +23,7 @@ def process_for_platforms(input_path):
         'ffmpeg', '-y', '-i', input_path,
         '-vf', 'crop=ih*(9/16):ih,scale=1080:1920',
         '-an', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', f"{base}_spotify.mp4"
-    ])
+    ], check=True)
 
     # 2. Apple Music (1:1 Square)
     print("🎬 Formatting for Apple Music (1:1)...")
@@ -30,7 +31,7 @@ def process_for_platforms(input_path):
         'ffmpeg', '-y', '-i', input_path,
         '-vf', 'crop=ih:ih,scale=3840:3840',
         '-an', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', f"{base}_apple_1x1.mp4"
-    ])
+    ], check=True)
 
     # 3. Apple Music (3:4 Vertical)
     print("🎬 Formatting for Apple Music (3:4)...")
@@ -38,7 +39,7 @@ def process_for_platforms(input_path):
         'ffmpeg', '-y', '-i', input_path,
         '-vf', 'crop=ih*(3/4):ih,scale=2048:2732',
         '-an', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', f"{base}_apple_3x4.mp4"
-    ])
+    ], check=True)
 
 if __name__ == "__main__":
     # Check if a URL was actually provided in the command line
@@ -48,5 +49,9 @@ if __name__ == "__main__":
 
     video_url = sys.argv[1]
     local_file = download_video(video_url, "input_video.mp4")
-    process_for_platforms(local_file)
+    try:
+        process_for_platforms(local_file)
+    except subprocess.CalledProcessError as e:
+        print(f"❌ FFmpeg failed (exit code {e.returncode}): {' '.join(e.cmd)}")
+        sys.exit(1)
     print("🚀 DONE! Check the 'Result' folder.")
\ No newline at end of file
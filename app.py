@@ -2,6 +2,9 @@ import os
 import base64
 import time
 import subprocess
+import json
+import shutil
+from collections import deque
 
 # Ensure Homebrew binaries (ffmpeg) are in PATH on macOS
 os.environ['PATH'] = '/opt/homebrew/bin:/usr/local/bin:' + os.environ.get('PATH', '')
@@ -10,17 +13,27 @@ import imghdr
 import sqlite3
 import threading
 import uuid
+import random
+from contextlib import contextmanager
+from functools import wraps
 import smtplib
 from email.mime.text import MIMEText
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, redirect
 from werkzeug.utils import secure_filename
-from runwayml import RunwayML, TaskFailedError
+from runwayml import RunwayML, TaskFailedError, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
 import requests
+import httpx
 import stripe
 from PIL import Image
 import pillow_heif
 pillow_heif.register_heif_opener()
 from flask_talisman import Talisman
+from backends import FileStorage, S3Storage, PostgresPool
+try:
+    import gevent
+    import gevent.monkey
+except ImportError:  # gevent is optional — only needed for the gevent worker class
+    gevent = None
 
 app = Flask(__name__)
 
@@ -49,40 +62,136 @@ print(f"📁 BASE_DIR: {BASE_DIR}")
 print(f"📁 Upload folder: {app.config['UPLOAD_FOLDER']}")
 print(f"📁 Result folder: {app.config['RESULT_FOLDER']}")
 
-# --- SQLite Setup ---
-DB_PATH = os.path.join(BASE_DIR, 'covertify.db')
+# --- File storage ---
+# file (default): uploads/ and Result/ on local disk — single replica only.
+# s3: S3-compatible bucket (S3, R2, MinIO); the folders above become local scratch space.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'file').lower()
+if STORAGE_BACKEND == 's3':
+    storage = S3Storage(
+        os.environ['S3_BUCKET'],
+        prefix=os.environ.get('S3_PREFIX', ''),
+        endpoint_url=os.environ.get('S3_ENDPOINT_URL'),  # e.g. http://localhost:9000 for MinIO
+        region=os.environ.get('S3_REGION'),
+    )
+    print(f"🪣 Using S3 storage: bucket {storage.bucket}")
+else:
+    storage = FileStorage({'uploads': app.config['UPLOAD_FOLDER'], 'results': app.config['RESULT_FOLDER']})
+
+# --- Database Setup ---
+# SQLite file by default; set DATABASE_URL (Postgres) to share sessions and jobs across replicas.
+DB_PATH = os.environ.get('SQLITE_PATH', os.path.join(BASE_DIR, 'covertify.db'))
+DATABASE_URL = os.environ.get('DATABASE_URL')
+DB_DIALECT = 'postgres' if DATABASE_URL else 'sqlite'
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 10)  # Postgres connections per process
+
+def is_gevent_worker():
+    """True when running under gunicorn's gevent worker (sockets monkey-patched)."""
+    return gevent is not None and gevent.monkey.is_module_patched('socket')
+
+# Native id of the thread running the gevent hub (the one importing the app)
+HUB_THREAD_ID = gevent.monkey.get_original('threading', 'get_ident')() if gevent else None
+
+def run_cooperative(fn, *args, **kwargs):
+    """Run a blocking C-level call without stalling other greenlets.
+
+    Under gevent it runs on the hub's native thread pool; otherwise (or when already
+    on a pool thread) it is a plain call. Network I/O (Stripe, Runway, requests) and
+    subprocesses are already cooperative through monkey-patching — this is for things
+    like SQLite and libpq that block in C.
+    """
+    if is_gevent_worker() and gevent.monkey.get_original('threading', 'get_ident')() == HUB_THREAD_ID:
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
+
+def cooperative(fn):
+    """Decorator: run fn through run_cooperative.
+
+    Put it on functions that hold a whole `with get_db()` transaction, so every
+    statement and the commit run on the same pool thread. Offloading statements one
+    by one deadlocks: greenlets blocked in BEGIN IMMEDIATE fill the pool and the
+    lock holder can't get a thread to commit.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return run_cooperative(fn, *args, **kwargs)
+    return wrapper
+
+postgres_pools = {}
+postgres_pools_lock = threading.Lock()
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")  # Better concurrent read/write
+    """Open a connection. Call it inside a @cooperative function: connecting blocks in C."""
+    if DB_DIALECT == 'postgres':
+        with postgres_pools_lock:
+            if DATABASE_URL not in postgres_pools:
+                postgres_pools[DATABASE_URL] = PostgresPool(DATABASE_URL, DATABASE_POOL_SIZE)
+        conn = postgres_pools[DATABASE_URL].connection()
+    else:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")  # Better concurrent read/write
     return conn
 
+def lock_for_write(conn, key):
+    """Serialize writers on key for the rest of the current transaction"""
+    if DB_DIALECT == 'postgres':
+        conn.execute("SELECT pg_advisory_xact_lock(hashtext(?))", (key,))
+    else:
+        # IMMEDIATE takes SQLite's (database-wide) write lock up front
+        conn.execute("BEGIN IMMEDIATE")
+
+def table_columns(conn, table):
+    if DB_DIALECT == 'postgres':
+        rows = conn.execute(
+            "SELECT column_name AS name FROM information_schema.columns WHERE table_name = ?", (table,)
+        )
+    else:
+        rows = conn.execute(f"PRAGMA table_info({table})")
+    return {row['name'] for row in rows}
+
 def init_db():
+    # Postgres REAL is single precision — too coarse for epoch timestamps
+    ts = 'DOUBLE PRECISION' if DB_DIALECT == 'postgres' else 'REAL'
     with get_db() as conn:
-        conn.execute('''CREATE TABLE IF NOT EXISTS sessions (
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS sessions (
             session_id TEXT PRIMARY KEY,
             paid INTEGER DEFAULT 0,
             image_id TEXT,
-            created_at REAL,
+            created_at {ts},
             used INTEGER DEFAULT 0,
-            used_at REAL,
+            used_at {ts},
             email TEXT
         )''')
-        conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS jobs (
             job_id TEXT PRIMARY KEY,
             session_id TEXT,
             status TEXT DEFAULT 'pending',
-            created_at REAL,
-            updated_at REAL,
+            created_at {ts},
+            updated_at {ts},
             spotify_video TEXT,
             apple_square_video TEXT,
             apple_portrait_video TEXT,
             original_video TEXT,
             video_url TEXT,
             error TEXT,
-            message TEXT
+            message TEXT,
+            encode_stats TEXT,
+            image_name TEXT,
+            claimed_by TEXT,
+            claimed_at {ts}
         )''')
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            tokens {ts},
+            updated_at {ts}
+        )''')
+        # Columns added after the first release
+        job_columns = table_columns(conn, 'jobs')
+        for column, column_type in (('encode_stats', 'TEXT'), ('image_name', 'TEXT'),
+                                    ('claimed_by', 'TEXT'), ('claimed_at', ts)):
+            if column not in job_columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
         conn.commit()
 
 init_db()
@@ -121,6 +230,10 @@ csp = {
     ]
 }
 
+# Previews are served straight from the object store when one is configured
+if storage.public_origin():
+    csp['media-src'] = ['\'self\'', storage.public_origin()]
+
 Talisman(
     app,
     force_https=not LOCAL_DEV,
@@ -128,8 +241,168 @@ Talisman(
     content_security_policy=csp
 )
 
-# Initialize Runway client
-client = RunwayML()
+# Initialize Runway client — retries are handled by RunwayGovernor below
+client = RunwayML(max_retries=0)
+
+# --- Runway concurrency governor ---
+# The governor's state lives in each process. RUNWAY_MAX_CONCURRENT,
+# RUNWAY_REQUESTS_PER_SECOND and RUNWAY_REQUEST_BURST are account-wide totals,
+# split evenly across RUNWAY_PROCESSES (default: WEB_CONCURRENCY, the number of
+# gunicorn workers). Set RUNWAY_PROCESSES to the total number of processes that
+# generate (web workers plus worker.py processes) when running more than one.
+# Every process needs at least one slot, so keep RUNWAY_PROCESSES <= RUNWAY_MAX_CONCURRENT.
+RUNWAY_PROCESSES = max(1, int(os.environ.get('RUNWAY_PROCESSES', os.environ.get('WEB_CONCURRENCY', 2))))
+RUNWAY_MAX_CONCURRENT = int(os.environ.get('RUNWAY_MAX_CONCURRENT', 2))  # concurrent tasks allowed by our tier
+RUNWAY_REQUESTS_PER_SECOND = float(os.environ.get('RUNWAY_REQUESTS_PER_SECOND', 1))
+RUNWAY_REQUEST_BURST = int(os.environ.get('RUNWAY_REQUEST_BURST', 5))
+RUNWAY_MAX_RETRIES = int(os.environ.get('RUNWAY_MAX_RETRIES', 5))
+RUNWAY_POLL_DEADLINE = float(os.environ.get('RUNWAY_POLL_DEADLINE', 1800))  # seconds to keep retrying status polls
+RUNWAY_BREAKER_THRESHOLD = int(os.environ.get('RUNWAY_BREAKER_THRESHOLD', 5))  # consecutive failures to trip
+RUNWAY_BREAKER_COOLDOWN = float(os.environ.get('RUNWAY_BREAKER_COOLDOWN', 60))  # seconds paused once tripped
+
+RUNWAY_TRANSIENT_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+def is_safe_to_resend(error):
+    """True if a failed call certainly did not reach Runway.
+
+    Timeouts and 5xx can happen after Runway accepted the request, so resending a
+    create could start (and bill) a second task. Only rate limits and failures to
+    connect are safe to retry for non-idempotent calls.
+    """
+    if isinstance(error, RateLimitError):
+        return True
+    return isinstance(error, APIConnectionError) and not isinstance(error, APITimeoutError) \
+        and isinstance(error.__cause__, httpx.ConnectError)
+
+class TokenBucket:
+    """Thread-safe token bucket: take() blocks until a token is available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_take(self):
+        """Take a token if one is available. Returns 0, or the seconds until one is."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def take(self):
+        while True:
+            wait = self.try_take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+class RunwayGovernor:
+    """Wraps Runway calls with a concurrency cap, rate limit, retries and a circuit breaker.
+
+    - slot(): holds one of RUNWAY_MAX_CONCURRENT generation slots; extra jobs queue here
+    - call(): rate-limited API call with jittered exponential backoff on transient errors
+    - the breaker opens after RUNWAY_BREAKER_THRESHOLD consecutive transient failures and
+      pauses new calls for RUNWAY_BREAKER_COOLDOWN seconds instead of hammering the API
+    """
+
+    def __init__(self, max_concurrent, rate, burst, max_retries, breaker_threshold, breaker_cooldown):
+        self.max_concurrent = max_concurrent
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.failures = 0
+        self.open_until = 0
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        return time.monotonic() < self.open_until
+
+    def wait_until_closed(self):
+        while True:
+            with self.lock:
+                remaining = self.open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.breaker_threshold and not self.is_open():
+                self.open_until = time.monotonic() + self.breaker_cooldown
+                print(f"🛑 Runway circuit breaker open for {self.breaker_cooldown:.0f}s "
+                      f"after {self.failures} consecutive failures")
+
+    @contextmanager
+    def slot(self):
+        """Hold one generation slot; waits out an open breaker before queueing."""
+        self.wait_until_closed()
+        with self.slots:
+            yield
+
+    def call(self, fn, *args, retry_if=None, deadline=None, **kwargs):
+        """Run a Runway API call, retrying transient errors with jittered backoff.
+
+        retry_if: predicate deciding whether a transient error may be retried
+        (default: all of them — fine for reads, not for creates).
+        deadline: time.monotonic() value to keep retrying until, instead of stopping
+        after max_retries.
+        """
+        attempt = 0
+        while True:
+            self.wait_until_closed()
+            self.bucket.take()
+            try:
+                result = fn(*args, **kwargs)
+            except RUNWAY_TRANSIENT_ERRORS as e:
+                self.record_failure()
+                if retry_if is not None and not retry_if(e):
+                    raise
+                attempt += 1
+                delay = random.uniform(0, min(60, 2 ** attempt))  # full jitter
+                if deadline is None:
+                    if attempt > self.max_retries:
+                        raise
+                    print(f"⚠️ Runway transient error ({type(e).__name__}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise
+                    delay = min(delay, remaining)
+                    print(f"⚠️ Runway transient error ({type(e).__name__}), retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            self.record_success()
+            return result
+
+def build_runway_governor(processes, max_concurrent=RUNWAY_MAX_CONCURRENT):
+    """Governor holding this process's share of the account-wide Runway limits"""
+    if max_concurrent < processes:
+        print(f"⚠️ RUNWAY_MAX_CONCURRENT={max_concurrent} is less than RUNWAY_PROCESSES={processes}: "
+              f"each process still gets 1 slot, so up to {processes} tasks can run at once "
+              f"and Runway will reject the extra ones")
+    return RunwayGovernor(
+        max(1, max_concurrent // processes),
+        RUNWAY_REQUESTS_PER_SECOND / processes,
+        max(1, RUNWAY_REQUEST_BURST // processes),
+        RUNWAY_MAX_RETRIES,
+        RUNWAY_BREAKER_THRESHOLD,
+        RUNWAY_BREAKER_COOLDOWN,
+    )
+
+runway_governor = build_runway_governor(RUNWAY_PROCESSES)
 
 # Credits config — gen3a_turbo costs 50 credits per 5s video
 RUNWAY_CREDIT_THRESHOLD = 100  # minimum credits to accept new payments (2 videos buffer)
@@ -207,10 +480,10 @@ def validate_image_format(filepath):
                 img.verify()
             with Image.open(filepath) as img:
                 width, height = img.size
-                if width < 256 or height < 256:
-                    return False, "Image too small. Minimum size: 256x256 pixels."
-                if width > 4096 or height > 4096:
-                    return False, "Image too large. Maximum size: 4096x4096 pixels."
+                if width < MIN_IMAGE_SIDE or height < MIN_IMAGE_SIDE:
+                    return False, f"Image too small. Minimum size: {MIN_IMAGE_SIDE}x{MIN_IMAGE_SIDE} pixels."
+                if width > MAX_IMAGE_SIDE or height > MAX_IMAGE_SIDE:
+                    return False, f"Image too large. Maximum size: {MAX_IMAGE_SIDE}x{MAX_IMAGE_SIDE} pixels."
         except Exception as e:
             return False, f"Invalid or corrupted image file: {str(e)}"
 
@@ -233,31 +506,38 @@ def generate_video(image_path, prompt, duration=5):
         print(f"🚀 Starting generation for: {prompt}")
         image_uri = file_to_data_uri(image_path)
 
-        task = client.image_to_video.create(
-            model='gen3a_turbo',
-            prompt_image=image_uri,
-            prompt_text=prompt,
-            ratio="1280:768",
-            duration=duration
-        )
+        # Queue here until a Runway slot is free (and the breaker is closed)
+        with runway_governor.slot():
+            task = runway_governor.call(
+                client.image_to_video.create,
+                retry_if=is_safe_to_resend,
+                model='gen3a_turbo',
+                prompt_image=image_uri,
+                prompt_text=prompt,
+                ratio="1280:768",
+                duration=duration
+            )
 
-        task_id = task.id
-        print(f"⏳ Task created (ID: {task_id}). Waiting for completion...")
+            task_id = task.id
+            print(f"⏳ Task created (ID: {task_id}). Waiting for completion...")
+            # The task keeps running on Runway's side while we can't reach it,
+            # so polling errors are retried (and the breaker waited out) up to a deadline
+            poll_deadline = time.monotonic() + RUNWAY_POLL_DEADLINE
 
-        while True:
-            task = client.tasks.retrieve(task_id)
-            print(f"⏱️  Task status: {task.status}")
+            while True:
+                task = runway_governor.call(client.tasks.retrieve, task_id, deadline=poll_deadline)
+                print(f"⏱️  Task status: {task.status}")
 
-            if task.status == 'SUCCEEDED':
-                print("✅ Generation Complete!")
-                return {'success': True, 'video_url': task.output[0], 'task_id': task_id}
-            elif task.status == 'FAILED':
-                failure_reason = getattr(task, 'failure', getattr(task, 'failure_reason', 'Unknown failure'))
-                failure_code = getattr(task, 'failure_code', 'N/A')
-                print(f"❌ Task failed! Reason: {failure_reason} Code: {failure_code}")
-                return {'success': False, 'error': f"{failure_code}: {failure_reason}"}
+                if task.status == 'SUCCEEDED':
+                    print("✅ Generation Complete!")
+                    return {'success': True, 'video_url': task.output[0], 'task_id': task_id}
+                elif task.status == 'FAILED':
+                    failure_reason = getattr(task, 'failure', getattr(task, 'failure_reason', 'Unknown failure'))
+                    failure_code = getattr(task, 'failure_code', 'N/A')
+                    print(f"❌ Task failed! Reason: {failure_reason} Code: {failure_code}")
+                    return {'success': False, 'error': f"{failure_code}: {failure_reason}"}
 
-            time.sleep(5)
+                time.sleep(5)
 
     except TaskFailedError as e:
         print(f"API Error: {e}")
@@ -282,69 +562,363 @@ def download_video(url, filename):
     print(f"✅ Download complete! Size: {total_size} bytes")
     return filepath
 
+# --- Upload admission ---
+# Uploads happen before payment, so anyone can send them: rate-limit per client and
+# reject bad files from their header before Pillow decodes anything.
+UPLOAD_RATE_PER_MINUTE = float(os.environ.get('UPLOAD_RATE_PER_MINUTE', 6))
+UPLOAD_BURST = int(os.environ.get('UPLOAD_BURST', 3))
+# Proxies in front of the app whose X-Forwarded-For we trust. Railway's edge adds one;
+# with no proxy (local runs) the header is client-controlled and must be ignored.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1 if os.environ.get('RAILWAY_ENVIRONMENT') else 0))
+HEIC_WORKERS = int(os.environ.get('HEIC_WORKERS', 2))  # concurrent HEIC conversions
+HEIC_QUEUE_TIMEOUT = float(os.environ.get('HEIC_QUEUE_TIMEOUT', 10))  # seconds to wait for a slot
+RATE_LIMIT_SWEEP_INTERVAL = 3600  # seconds between deletes of idle rate-limit buckets
+
+MIN_IMAGE_SIDE = 256
+MAX_IMAGE_SIDE = 4096
+ALLOWED_IMAGE_FORMATS = {'PNG', 'JPEG', 'MPO', 'GIF', 'WEBP', 'HEIF'}  # MPO: multi-picture phone JPEGs
+
+# Pillow raises DecompressionBombError at twice this many pixels in any decode path
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_SIDE * MAX_IMAGE_SIDE
+
+heic_slots = threading.BoundedSemaphore(HEIC_WORKERS)
+
+def client_ip():
+    """Client address as seen by the last trusted proxy"""
+    forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+    if TRUSTED_PROXY_HOPS and len(forwarded) >= TRUSTED_PROXY_HOPS:
+        return forwarded[-TRUSTED_PROXY_HOPS]
+    return request.remote_addr
+
+@cooperative
+def check_upload_rate(ip):
+    """Take an upload token for ip. Returns 0, or seconds the client should wait.
+
+    The bucket lives in the database, so the limit holds across gunicorn workers
+    and (with DATABASE_URL) across replicas. Refill and take happen in one upsert,
+    without an explicit lock: unpaid traffic must not queue for the write lock
+    that paid jobs use.
+    """
+    key = f"upload:{ip}"
+    rate = UPLOAD_RATE_PER_MINUTE / 60
+    now = time.time()
+    refill = ("CASE WHEN rate_limits.tokens + (? - rate_limits.updated_at) * ? > ? THEN ? "
+              "ELSE rate_limits.tokens + (? - rate_limits.updated_at) * ? END")
+    refill_params = (now, rate, UPLOAD_BURST, UPLOAD_BURST, now, rate)
+    with get_db() as conn:
+        # A denied take updates nothing, so RETURNING yields no row
+        taken = conn.execute(
+            f"INSERT INTO rate_limits (key, tokens, updated_at) VALUES (?, ?, ?) "
+            f"ON CONFLICT (key) DO UPDATE SET tokens = {refill} - 1, updated_at = excluded.updated_at "
+            f"WHERE {refill} >= 1 RETURNING tokens",
+            (key, UPLOAD_BURST - 1, now) + refill_params + refill_params
+        ).fetchone()
+        if not taken:
+            row = conn.execute("SELECT tokens, updated_at FROM rate_limits WHERE key = ?", (key,)).fetchone()
+        conn.commit()
+    if taken:
+        return 0
+    # Another request may have updated the bucket after our `now`
+    tokens = min(UPLOAD_BURST, row['tokens'] + max(0, now - row['updated_at']) * rate)
+    return max(0, (1 - tokens) / rate)
+
+@cooperative
+def prune_rate_limits():
+    """Drop buckets idle for a day — they are full again anyway"""
+    with get_db() as conn:
+        conn.execute("DELETE FROM rate_limits WHERE updated_at < ?", (time.time() - 86400,))
+        conn.commit()
+
+def sweep_rate_limits():
+    while True:
+        try:
+            prune_rate_limits()
+        except Exception as e:
+            print(f"⚠️ Rate limit sweep failed: {e}")
+        time.sleep(RATE_LIMIT_SWEEP_INTERVAL)
+
+threading.Thread(target=sweep_rate_limits, daemon=True).start()
+
+def sniff_image_header(stream):
+    """Check format and dimensions from the image header only — nothing is decoded.
+
+    Image.open just parses the header; pixel data is read lazily. Leaves the stream
+    rewound so it can still be saved.
+    """
+    try:
+        with Image.open(stream) as img:
+            image_format = img.format
+            width, height = img.size
+    except Image.DecompressionBombError:
+        return False, f"Image too large. Maximum size: {MAX_IMAGE_SIDE}x{MAX_IMAGE_SIDE} pixels."
+    except Exception:
+        return False, "File is not a supported image"
+    finally:
+        stream.seek(0)
+
+    if image_format not in ALLOWED_IMAGE_FORMATS:
+        return False, "Invalid file type"
+    if width < MIN_IMAGE_SIDE or height < MIN_IMAGE_SIDE:
+        return False, f"Image too small. Minimum size: {MIN_IMAGE_SIDE}x{MIN_IMAGE_SIDE} pixels."
+    if width > MAX_IMAGE_SIDE or height > MAX_IMAGE_SIDE:
+        return False, f"Image too large. Maximum size: {MAX_IMAGE_SIDE}x{MAX_IMAGE_SIDE} pixels."
+    return True, image_format
+
+# --- Output encoding ---
+# OUTPUT_CODEC: h264 (default) | hevc. Profiles that don't accept the
+# requested codec fall back to h264 (with a warning).
+OUTPUT_CODEC = os.environ.get('OUTPUT_CODEC', 'h264').lower()
+
+def parse_target_mb(value):
+    """Parse OUTPUT_TARGET_MB: "apple_square=20,apple_portrait=15", or a bare "20" for every profile.
+
+    Returns {profile_key or '*': megabytes}. Bad entries are reported and skipped.
+    """
+    targets = {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        key, _, size = item.rpartition('=')
+        try:
+            targets[key.strip() or '*'] = float(size)
+        except ValueError:
+            print(f"⚠️ Ignoring invalid OUTPUT_TARGET_MB entry: {item!r}")
+    return targets
+
+# OUTPUT_TARGET_MB: optional size targets. Profiles with a target are encoded
+# two-pass at the bitrate that hits it instead of CRF.
+OUTPUT_TARGET_MB = parse_target_mb(os.environ.get('OUTPUT_TARGET_MB', ''))
+FFMPEG_TIMEOUT = int(os.environ.get('FFMPEG_TIMEOUT', 120))
+
+CODECS = {
+    'h264': {'encoder': 'libx264', 'quality': ['-preset', 'ultrafast', '-crf', '28'],
+             'bitrate_preset': ['-preset', 'veryfast']},
+    'hevc': {'encoder': 'libx265', 'quality': ['-preset', 'fast', '-crf', '30'],
+             'bitrate_preset': ['-preset', 'fast'], 'extra': ['-tag:v', 'hvc1']},
+}
+
+if OUTPUT_CODEC not in CODECS:
+    print(f"⚠️ Unknown OUTPUT_CODEC {OUTPUT_CODEC!r} — using h264 (options: {', '.join(CODECS)})")
+
+PLATFORM_PROFILES = [
+    {'key': 'spotify', 'label': 'Spotify Canvas', 'suffix': 'spotify',
+     'vf': 'crop=ih*(9/16):ih,scale=1080:1920', 'bufsize': '1M', 'codecs': ('h264',)},
+    {'key': 'apple_square', 'label': 'Apple Music Standard', 'suffix': 'apple_square',
+     'vf': 'crop=ih:ih,scale=3840:3840', 'bufsize': '2M', 'codecs': ('h264', 'hevc')},
+    {'key': 'apple_portrait', 'label': 'Apple Music Listening Mode', 'suffix': 'apple_portrait',
+     'vf': 'crop=ih*(3/4):ih,scale=2048:2732', 'bufsize': '1.5M', 'codecs': ('h264', 'hevc')},
+]
+
+# --- ffmpeg resource control ---
+# Keeps encodes from starving the web threads in the same container.
+FFMPEG_NICE = int(os.environ.get('FFMPEG_NICE', 10))  # 0 = normal priority
+FFMPEG_IONICE = os.environ.get('FFMPEG_IONICE', '2:7')  # "class:level" for ionice, empty to disable
+FFMPEG_RLIMIT_CPU = int(os.environ.get('FFMPEG_RLIMIT_CPU', 0))  # CPU seconds per process, 0 = unlimited
+FFMPEG_RLIMIT_MEMORY_MB = int(os.environ.get('FFMPEG_RLIMIT_MEMORY_MB', 0))  # address space, 0 = unlimited
+
+def parse_cpu_list(value):
+    """Parse "0-3,6" into {0, 1, 2, 3, 6}"""
+    cpus = set()
+    for part in value.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cpus.update(range(int(start), int(end) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+FFMPEG_CPUS = os.environ.get('FFMPEG_CPUS', '').strip()  # taskset CPU list, e.g. "2-3", empty = any CPU
+# Total encoder threads for the container; default leaves one core for the web workers.
+# Each process that encodes gets an equal share: set FFMPEG_PROCESSES to the number
+# of such processes (gunicorn workers, worker.py) — default WEB_CONCURRENCY.
+FFMPEG_THREAD_BUDGET = int(os.environ.get('FFMPEG_THREAD_BUDGET') or (
+    len(parse_cpu_list(FFMPEG_CPUS)) or max(1, (os.cpu_count() or 2) - 1)
+))
+FFMPEG_PROCESSES = max(1, int(os.environ.get('FFMPEG_PROCESSES') or os.environ.get('WEB_CONCURRENCY') or 2))
+# Encodes a process runs side by side. Encodes follow generations, so by default
+# this matches the process's Runway slots.
+FFMPEG_CONCURRENT_ENCODES = max(1, int(os.environ.get('FFMPEG_CONCURRENT_ENCODES') or (
+    RUNWAY_MAX_CONCURRENT // RUNWAY_PROCESSES
+)))
+
+class ThreadBudget:
+    """Splits a fixed pool of encoder threads among up to max_encodes concurrent encodes.
+
+    Each encode gets budget // max_encodes threads (at least one) for its whole run,
+    so max_encodes encodes run side by side without exceeding the budget. Further
+    encodes wait for a free slot.
+    """
+
+    def __init__(self, budget, max_encodes):
+        self.budget = budget
+        self.max_encodes = max(1, max_encodes)
+        self.threads = max(1, budget // self.max_encodes)
+        self.slots = threading.BoundedSemaphore(self.max_encodes)
+        self.active = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        with self.slots:
+            with self.lock:
+                self.active += 1
+            try:
+                yield self.threads
+            finally:
+                with self.lock:
+                    self.active -= 1
+
+ffmpeg_budget = ThreadBudget(max(1, FFMPEG_THREAD_BUDGET // FFMPEG_PROCESSES), FFMPEG_CONCURRENT_ENCODES)
+
+def limit_prefix():
+    """Command prefix that applies the limits above to the child.
+
+    Done with nice/ionice/taskset/prlimit wrappers rather than preexec_fn, which
+    isn't safe in a process with threads. Tools that aren't installed are skipped.
+    """
+    prefix = []
+    if FFMPEG_RLIMIT_CPU or FFMPEG_RLIMIT_MEMORY_MB:
+        if shutil.which('prlimit'):
+            prefix += ['prlimit']
+            if FFMPEG_RLIMIT_CPU:
+                prefix += [f'--cpu={FFMPEG_RLIMIT_CPU}']
+            if FFMPEG_RLIMIT_MEMORY_MB:
+                prefix += [f'--as={FFMPEG_RLIMIT_MEMORY_MB * 1024 * 1024}']
+            prefix += ['--']
+        else:
+            print("⚠️ prlimit not installed — FFMPEG_RLIMIT_* ignored")
+    if FFMPEG_CPUS:
+        if shutil.which('taskset'):
+            prefix += ['taskset', '-c', FFMPEG_CPUS]
+        else:
+            print("⚠️ taskset not installed — FFMPEG_CPUS ignored")
+    if FFMPEG_IONICE and shutil.which('ionice'):
+        io_class, _, io_level = FFMPEG_IONICE.partition(':')
+        prefix += ['ionice', '-c', io_class] + (['-n', io_level] if io_level else [])
+    if FFMPEG_NICE and shutil.which('nice'):
+        prefix += ['nice', '-n', str(FFMPEG_NICE)]
+    return prefix
+
+def run_ffmpeg(cmd, timeout=None):
+    """Run an ffmpeg command under the resource limits above.
+
+    stderr is streamed line by line and only the tail is kept, instead of buffering
+    everything like capture_output. Returns a CompletedProcess (stderr = tail) and
+    raises subprocess.TimeoutExpired like subprocess.run.
+    """
+    timeout = timeout or FFMPEG_TIMEOUT
+    cmd = limit_prefix() + cmd
+
+    tail = deque(maxlen=50)
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        proc.kill()
+
+    watchdog = threading.Timer(timeout, kill)
+    watchdog.daemon = True
+    watchdog.start()
+    try:
+        for line in proc.stderr:
+            tail.append(line)
+        proc.wait()
+    finally:
+        watchdog.cancel()
+        proc.stderr.close()
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout, stderr=''.join(tail))
+    return subprocess.CompletedProcess(cmd, proc.returncode, stderr=''.join(tail))
+
+def probe_duration(input_path):
+    """Return video duration in seconds using ffprobe"""
+    result = subprocess.run([
+        'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1', input_path
+    ], capture_output=True, text=True, timeout=30, check=True)
+    return float(result.stdout.strip())
+
+def encode_profile(input_path, output_file, profile, codec, target_mb=None, threads=2):
+    """Encode one platform rendition. Returns the last ffmpeg result."""
+    spec = CODECS[codec]
+    base_cmd = [
+        'ffmpeg', '-y', '-i', input_path,
+        '-vf', profile['vf'],
+        '-an', '-c:v', spec['encoder'], '-pix_fmt', 'yuv420p',
+        '-threads', str(threads),
+    ]
+
+    if not target_mb:
+        cmd = base_cmd + spec['quality'] + ['-bufsize', profile['bufsize']] + spec.get('extra', []) + [output_file]
+        return run_ffmpeg(cmd)
+
+    # Size-targeted mode: bitrate = target bits / duration (video only, no audio track)
+    kbps = int(target_mb * 8 * 1024 / probe_duration(input_path))
+    rate = ['-b:v', f'{kbps}k', '-maxrate', f'{int(kbps * 1.5)}k', '-bufsize', f'{kbps * 2}k']
+
+    passlog = f"{os.path.splitext(output_file)[0]}_passlog"
+    if codec == 'hevc':
+        pass_args = lambda n: ['-x265-params', f'pass={n}:stats={passlog}.log']
+    else:
+        pass_args = lambda n: ['-pass', str(n), '-passlogfile', passlog]
+
+    try:
+        result = run_ffmpeg(base_cmd + spec['bitrate_preset'] + rate + pass_args(1) + ['-f', 'null', os.devnull])
+        if result.returncode != 0:
+            return result
+        return run_ffmpeg(base_cmd + spec['bitrate_preset'] + rate + pass_args(2) + spec.get('extra', []) + [output_file])
+    finally:
+        import glob as glob_module
+        for f in glob_module.glob(f"{passlog}*"):
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
 def process_for_platforms(input_path):
-    """Process video for different platform formats"""
+    """Process video for different platform formats.
+
+    Returns the output filenames plus per-profile stats (codec, mode, size, encode time).
+    """
     base = os.path.splitext(input_path)[0]
     processed_files = {}
+    stats = {}
 
     print(f"🔍 Input file: {input_path} (exists: {os.path.exists(input_path)})")
 
     try:
-        # 1. Spotify Canvas (9:16 Vertical)
-        print("🎬 Formatting for Spotify Canvas...")
-        spotify_file = f"{base}_spotify.mp4"
-        result = subprocess.run([
-            'ffmpeg', '-y', '-i', input_path,
-            '-vf', 'crop=ih*(9/16):ih,scale=1080:1920',
-            '-an', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
-            '-preset', 'ultrafast', '-crf', '28',
-            '-threads', '2', '-bufsize', '1M',
-            spotify_file
-        ], capture_output=True, text=True, timeout=120)
-
-        if os.path.exists(spotify_file) and os.path.getsize(spotify_file) > 1000:
-            processed_files['spotify'] = os.path.basename(spotify_file)
-            print(f"✅ Spotify Canvas complete! Size: {os.path.getsize(spotify_file)} bytes")
-        else:
-            raise Exception(f"Spotify Canvas encoding failed: {result.stderr[-200:]}")
-
-        # 2. Apple Music Standard (1:1 Square - 3840x3840)
-        print("🎬 Formatting for Apple Music Standard (1:1)...")
-        apple_square_file = f"{base}_apple_square.mp4"
-        result = subprocess.run([
-            'ffmpeg', '-y', '-i', input_path,
-            '-vf', 'crop=ih:ih,scale=3840:3840',
-            '-an', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
-            '-preset', 'ultrafast', '-crf', '28',
-            '-threads', '2', '-bufsize', '2M',
-            apple_square_file
-        ], capture_output=True, text=True, timeout=120)
-
-        if os.path.exists(apple_square_file) and os.path.getsize(apple_square_file) > 1000:
-            processed_files['apple_square'] = os.path.basename(apple_square_file)
-            print(f"✅ Apple Music Standard complete! Size: {os.path.getsize(apple_square_file)} bytes")
-        else:
-            raise Exception(f"Apple Music Standard encoding failed: {result.stderr[-200:]}")
-
-        # 3. Apple Music Listening Mode (3:4 Portrait - 2048x2732)
-        print("🎬 Formatting for Apple Music Listening Mode (3:4)...")
-        apple_portrait_file = f"{base}_apple_portrait.mp4"
-        result = subprocess.run([
-            'ffmpeg', '-y', '-i', input_path,
-            '-vf', 'crop=ih*(3/4):ih,scale=2048:2732',
-            '-an', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
-            '-preset', 'ultrafast', '-crf', '28',
-            '-threads', '2', '-bufsize', '1.5M',
-            apple_portrait_file
-        ], capture_output=True, text=True, timeout=120)
-
-        if os.path.exists(apple_portrait_file) and os.path.getsize(apple_portrait_file) > 1000:
-            processed_files['apple_portrait'] = os.path.basename(apple_portrait_file)
-            print(f"✅ Apple Music Listening Mode complete! Size: {os.path.getsize(apple_portrait_file)} bytes")
-        else:
-            raise Exception(f"Apple Music Listening Mode encoding failed: {result.stderr[-200:]}")
-
-        return {'success': True, 'files': processed_files}
+        for profile in PLATFORM_PROFILES:
+            codec = OUTPUT_CODEC if OUTPUT_CODEC in profile['codecs'] else 'h264'
+            if codec != OUTPUT_CODEC and OUTPUT_CODEC in CODECS:
+                print(f"⚠️ {profile['label']} doesn't accept {OUTPUT_CODEC} — encoding h264")
+            target_mb = OUTPUT_TARGET_MB.get(profile['key'], OUTPUT_TARGET_MB.get('*'))
+            output_file = f"{base}_{profile['suffix']}.mp4"
+
+            print(f"🎬 Formatting for {profile['label']} ({codec}{f', target {target_mb}MB' if target_mb else ''})...")
+            with ffmpeg_budget.slot() as threads:
+                started = time.time()
+                result = encode_profile(input_path, output_file, profile, codec, target_mb, threads)
+                elapsed = time.time() - started
+
+            if os.path.exists(output_file) and os.path.getsize(output_file) > 1000:
+                size = os.path.getsize(output_file)
+                processed_files[profile['key']] = os.path.basename(output_file)
+                stats[profile['key']] = {
+                    'codec': codec,
+                    'mode': 'target_size' if target_mb else 'crf',
+                    'bytes': size,
+                    'encode_seconds': round(elapsed, 2),
+                    'threads': threads,
+                }
+                print(f"✅ {profile['label']} complete! Size: {size} bytes in {elapsed:.1f}s")
+            else:
+                raise Exception(f"{profile['label']} encoding failed: {result.stderr[-200:]}")
+
+        return {'success': True, 'files': processed_files, 'stats': stats}
 
     except subprocess.TimeoutExpired as e:
         return {'success': False, 'error': f"FFmpeg timeout after {e.timeout}s"}
@@ -356,17 +930,38 @@ def process_for_platforms(input_path):
         return {'success': False, 'error': f"Processing error: {str(e)}"}
 
 
-def run_video_job(job_id, image_path, filename, session_id):
-    """Background thread: generate video and update job status in DB"""
+def store_results(names):
+    """Move finished videos from the local Result folder into storage"""
+    for name in names:
+        path = os.path.join(app.config['RESULT_FOLDER'], name)
+        if os.path.exists(path):
+            storage.put('results', path)
+
+def run_video_job(job_id, image_name, session_id, worker_id=None):
+    """Background thread or worker: generate video and update job status in DB
+
+    worker_id is set when the job was claimed from the queue: the claim is kept
+    alive with a heartbeat, and results are only written while we still hold it.
+    """
+    @cooperative
     def update_job(**kwargs):
         kwargs['updated_at'] = time.time()
         set_clause = ', '.join(f"{k} = ?" for k in kwargs)
         values = list(kwargs.values()) + [job_id]
+        where = "job_id = ?"
+        if worker_id:
+            where += " AND claimed_by = ?"
+            values.append(worker_id)
         with get_db() as conn:
-            conn.execute(f"UPDATE jobs SET {set_clause} WHERE job_id = ?", values)
+            updated = conn.execute(f"UPDATE jobs SET {set_clause} WHERE {where}", values).rowcount
             conn.commit()
+        if not updated:
+            print(f"⚠️ Job {job_id}: claim lost to another worker, result discarded")
 
+    heartbeat = start_heartbeat(job_id, worker_id) if worker_id else None
+    image_path = None
     try:
+        image_path = storage.local_path('uploads', image_name, app.config['UPLOAD_FOLDER'])
         prompt = 'Subtle cinematic motion, slow and small zoom in, high quality, no text'
         result = generate_video(image_path, prompt, duration=5)
 
@@ -375,21 +970,20 @@ def run_video_job(job_id, image_path, filename, session_id):
             return
 
         # Download the generated video
-        video_filename = f"{os.path.splitext(filename)[0]}_generated.mp4"
+        video_filename = f"{os.path.splitext(image_name)[0]}_generated.mp4"
         video_path = download_video(result['video_url'], video_filename)
 
         # Process for platforms
         print("🎨 Processing video for platform formats...")
         process_result = process_for_platforms(video_path)
+        if worker_id and not refresh_claim(job_id, worker_id):
+            # Another worker took the job over — don't overwrite its files or row
+            print(f"⚠️ Job {job_id}: claim lost to another worker, result discarded")
+            return
+        store_results([video_filename] + list(process_result.get('files', {}).values()))
 
         if process_result['success']:
-            # Mark session as used
-            with get_db() as conn:
-                conn.execute(
-                    "UPDATE sessions SET used = 1, used_at = ? WHERE session_id = ?",
-                    (time.time(), session_id)
-                )
-                conn.commit()
+            mark_session_used(session_id)
 
             update_job(
                 status='succeeded',
@@ -399,6 +993,7 @@ def run_video_job(job_id, image_path, filename, session_id):
                 spotify_video=process_result['files']['spotify'],
                 apple_square_video=process_result['files']['apple_square'],
                 apple_portrait_video=process_result['files']['apple_portrait'],
+                encode_stats=json.dumps(process_result['stats']),
             )
         else:
             update_job(
@@ -412,6 +1007,223 @@ def run_video_job(job_id, image_path, filename, session_id):
     except Exception as e:
         print(f"❌ Job {job_id} failed with exception: {e}")
         update_job(status='failed', error=str(e))
+    finally:
+        if heartbeat:
+            heartbeat.set()
+        # Drop the scratch copy of the image when storage is remote
+        if not storage.is_local and image_path and os.path.exists(image_path):
+            os.remove(image_path)
+
+
+# JOB_RUNNER: thread (default) runs jobs in a background thread of the web process.
+# queue leaves them 'queued' for worker.py processes, which claim them atomically.
+JOB_RUNNER = os.environ.get('JOB_RUNNER', 'thread').lower()
+JOB_CLAIM_TIMEOUT = int(os.environ.get('JOB_CLAIM_TIMEOUT', 1800))  # reclaim jobs from dead workers
+JOB_HEARTBEAT_INTERVAL = max(1, JOB_CLAIM_TIMEOUT // 6)  # live workers refresh claimed_at this often
+
+def find_uploaded_image(image_id):
+    """Return the stored name of the uploaded image for image_id, or None"""
+    names = storage.find('uploads', f"{image_id}.")
+    return names[0] if names else None
+
+def enqueue_video_job(session_id, image_id):
+    """Start a video job for a paid session, or attach to the one already running.
+
+    Safe to call from the Stripe webhook, /payment-success and /generate-video:
+    whichever arrives first creates the job, the others get the same job_id back.
+    A previous failed job does not block a retry.
+    """
+    image_name = find_uploaded_image(image_id)
+    if not image_name:
+        return {'success': False, 'error': f'Image file not found. Image ID: {image_id}', 'status_code': 404}
+
+    status = 'queued' if JOB_RUNNER == 'queue' else 'processing'
+    job_id, status, created = insert_job_once(session_id, image_name, status)
+    if not created:
+        return {'success': True, 'job_id': job_id, 'status': status, 'created': False}
+
+    if JOB_RUNNER == 'queue':
+        print(f"📥 Job {job_id} queued for session {session_id}")
+        return {'success': True, 'job_id': job_id, 'status': status, 'created': True}
+
+    # Start background thread — does not block the caller
+    thread = threading.Thread(
+        target=run_video_job,
+        args=(job_id, image_name, session_id),
+        daemon=True
+    )
+    thread.start()
+
+    print(f"🚀 Job {job_id} started for session {session_id}")
+    return {'success': True, 'job_id': job_id, 'status': status, 'created': True}
+
+@cooperative
+def insert_job_once(session_id, image_name, status):
+    """Insert a job for session_id unless a live one exists. Returns (job_id, status, created)."""
+    with get_db() as conn:
+        # Concurrent callers for the same session serialize here
+        lock_for_write(conn, session_id)
+        existing = conn.execute(
+            "SELECT job_id, status FROM jobs WHERE session_id = ? AND status != 'failed' "
+            "ORDER BY created_at DESC LIMIT 1",
+            (session_id,)
+        ).fetchone()
+        if existing:
+            conn.commit()
+            return existing['job_id'], existing['status'], False
+
+        job_id = str(uuid.uuid4())
+        conn.execute(
+            "INSERT INTO jobs (job_id, session_id, status, created_at, updated_at, image_name) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, session_id, status, time.time(), time.time(), image_name)
+        )
+        conn.commit()
+    return job_id, status, True
+
+@cooperative
+def claim_next_job(worker_id):
+    """Atomically claim the oldest queued job (or one abandoned by a dead worker).
+
+    Returns the job row, or None when there is nothing to do. Safe to call from
+    any number of worker processes on any number of nodes sharing the database.
+    """
+    now = time.time()
+    with get_db() as conn:
+        if DB_DIALECT == 'postgres':
+            pick = ("SELECT job_id FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'processing' AND claimed_at < ?) "
+                    "ORDER BY created_at LIMIT 1 FOR UPDATE SKIP LOCKED")
+        else:
+            lock_for_write(conn, 'claim')
+            pick = ("SELECT job_id FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'processing' AND claimed_at < ?) "
+                    "ORDER BY created_at LIMIT 1")
+        row = conn.execute(pick, (now - JOB_CLAIM_TIMEOUT,)).fetchone()
+        if not row:
+            conn.commit()
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'processing', claimed_by = ?, claimed_at = ?, updated_at = ? WHERE job_id = ?",
+            (worker_id, now, now, row['job_id'])
+        )
+        job = conn.execute(
+            "SELECT job_id, session_id, image_name FROM jobs WHERE job_id = ?", (row['job_id'],)
+        ).fetchone()
+        conn.commit()
+    return job
+
+@cooperative
+def refresh_claim(job_id, worker_id):
+    """Bump claimed_at on a job worker_id holds. Returns False if the claim was lost."""
+    with get_db() as conn:
+        updated = conn.execute(
+            "UPDATE jobs SET claimed_at = ? WHERE job_id = ? AND claimed_by = ?",
+            (time.time(), job_id, worker_id)
+        ).rowcount
+        conn.commit()
+    return updated == 1
+
+def start_heartbeat(job_id, worker_id):
+    """Refresh the claim every JOB_HEARTBEAT_INTERVAL until the returned event is set"""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                if not refresh_claim(job_id, worker_id):
+                    print(f"⚠️ Job {job_id}: claim lost to another worker")
+                    return
+            except Exception as e:
+                print(f"⚠️ Job {job_id}: heartbeat failed: {e}")
+
+    threading.Thread(target=beat, daemon=True).start()
+    return stop
+
+
+# --- Session and job records ---
+# Each helper is one whole transaction, run through run_cooperative (see cooperative).
+
+@cooperative
+def create_session(session_id, image_id):
+    with get_db() as conn:
+        conn.execute(
+            "INSERT INTO sessions (session_id, paid, image_id, created_at) VALUES (?, 0, ?, ?)",
+            (session_id, image_id, time.time())
+        )
+        conn.commit()
+
+@cooperative
+def load_session(session_id):
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+
+@cooperative
+def confirm_paid_session(session_id, image_id, email):
+    """Webhook: mark the session paid (creating it if needed). Returns the previous row."""
+    with get_db() as conn:
+        row = conn.execute(
+            "SELECT used, image_id FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE sessions SET paid = 1, email = ? WHERE session_id = ?",
+                (email, session_id)
+            )
+        elif image_id:
+            conn.execute(
+                "INSERT INTO sessions (session_id, paid, image_id, created_at, email) VALUES (?, 1, ?, ?, ?)",
+                (session_id, image_id, time.time(), email)
+            )
+        conn.commit()
+    return row
+
+@cooperative
+def upsert_paid_session(session_id, image_id):
+    """/generate-video: mark the session paid unless it was already used.
+
+    Returns (image_id, used, succeeded job row or None).
+    """
+    with get_db() as conn:
+        existing = conn.execute(
+            "SELECT used, image_id FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+
+        if existing:
+            if existing['used']:
+                # Already generated (e.g. started by the webhook) — hand back that job
+                done = conn.execute(
+                    "SELECT job_id, status FROM jobs WHERE session_id = ? AND status = 'succeeded' "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (session_id,)
+                ).fetchone()
+                return image_id, True, done
+            if not image_id:
+                image_id = existing['image_id']
+            conn.execute(
+                "UPDATE sessions SET paid = 1 WHERE session_id = ?", (session_id,)
+            )
+        elif image_id:
+            conn.execute(
+                "INSERT INTO sessions (session_id, paid, image_id, created_at) VALUES (?, 1, ?, ?)",
+                (session_id, image_id, time.time())
+            )
+        conn.commit()
+    return image_id, False, None
+
+@cooperative
+def mark_session_used(session_id):
+    with get_db() as conn:
+        conn.execute(
+            "UPDATE sessions SET used = 1, used_at = ? WHERE session_id = ?",
+            (time.time(), session_id)
+        )
+        conn.commit()
+
+@cooperative
+def load_job(job_id):
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
 
 
 # --- Routes ---
@@ -419,6 +1231,11 @@ def run_video_job(job_id, image_path, filename, session_id):
 @app.route('/service-status')
 def service_status():
     """Check if Runway credits are sufficient to accept new payments."""
+    if runway_governor.is_open():
+        # Runway is degraded — stop taking payments until the breaker closes.
+        # Breaker state is per process, so this reflects whichever worker answers.
+        return jsonify({'available': False, 'credits': None})
+
     credits = get_runway_credits()
     if credits is None:
         # Can't determine — allow through (fail open)
@@ -439,6 +1256,13 @@ def index():
 def upload_image():
     """Upload and store image before payment"""
     try:
+        # Rate-limit before the body is parsed
+        retry_after = check_upload_rate(client_ip())
+        if retry_after:
+            response = jsonify({'success': False, 'error': 'Too many uploads. Please wait a moment and try again.'})
+            response.headers['Retry-After'] = str(int(retry_after) + 1)
+            return response, 429
+
         if 'image' not in request.files:
             return jsonify({'success': False, 'error': 'No file uploaded'}), 400
 
@@ -449,6 +1273,11 @@ def upload_image():
         if not allowed_file(file.filename):
             return jsonify({'success': False, 'error': 'Invalid file type'}), 400
 
+        is_valid, header_message = sniff_image_header(file.stream)
+        if not is_valid:
+            print(f"❌ Image rejected from header: {header_message}")
+            return jsonify({'success': False, 'error': header_message}), 400
+
         filename = secure_filename(file.filename)
         unique_id = secrets.token_urlsafe(16)
         file_extension = filename.rsplit('.', 1)[1].lower()
@@ -460,8 +1289,14 @@ def upload_image():
 
         # Convert HEIC/HEIF to JPEG so Runway and Pillow can handle it
         if file_extension in ('heic', 'heif'):
+            # Conversion is CPU-heavy: run at most HEIC_WORKERS at once, shed load beyond that
+            if not heic_slots.acquire(timeout=HEIC_QUEUE_TIMEOUT):
+                os.remove(filepath)
+                response = jsonify({'success': False, 'error': 'Server busy. Please try again in a moment.'})
+                response.headers['Retry-After'] = '5'
+                return response, 503
             try:
-                filepath = convert_heic_to_jpeg(filepath)
+                filepath = run_cooperative(convert_heic_to_jpeg, filepath)
                 stored_filename = os.path.basename(filepath)
             except Exception as e:
                 try:
@@ -469,8 +1304,10 @@ def upload_image():
                 except:
                     pass
                 return jsonify({'success': False, 'error': f'Could not convert HEIC image: {str(e)}'}), 400
+            finally:
+                heic_slots.release()
 
-        is_valid, validation_message = validate_image_format(filepath)
+        is_valid, validation_message = run_cooperative(validate_image_format, filepath)
         if not is_valid:
             try:
                 os.remove(filepath)
@@ -480,6 +1317,7 @@ def upload_image():
             return jsonify({'success': False, 'error': validation_message}), 400
 
         print(f"✅ Image validated: {validation_message}")
+        storage.put('uploads', filepath)
         return jsonify({'success': True, 'image_id': unique_id, 'filename': stored_filename})
 
     except Exception as e:
@@ -505,12 +1343,7 @@ def create_payment_intent():
             metadata={'type': 'video_generation', 'image_id': image_id}
         )
 
-        with get_db() as conn:
-            conn.execute(
-                "INSERT INTO sessions (session_id, paid, image_id, created_at) VALUES (?, 0, ?, ?)",
-                (checkout_session.id, image_id, time.time())
-            )
-            conn.commit()
+        create_session(checkout_session.id, image_id)
 
         return jsonify({
             'success': True,
@@ -528,10 +1361,8 @@ def payment_success():
     session_id = request.args.get('session_id')
 
     if session_id:
-        with get_db() as conn:
-            row = conn.execute(
-                "SELECT paid, image_id FROM sessions WHERE session_id = ?", (session_id,)
-            ).fetchone()
+        row = load_session(session_id)
+        # The page then POSTs /generate-video, which attaches to the job the webhook started
         if row and row['paid']:
             return render_template('index.html',
                                    stripe_publishable_key=STRIPE_PUBLISHABLE_KEY,
@@ -566,24 +1397,26 @@ def stripe_webhook():
     if event['type'] == 'checkout.session.completed':
         session = event['data']['object']
         session_id = session['id']
-        email = session.get('customer_details', {}).get('email')
-        with get_db() as conn:
-            conn.execute(
-                "UPDATE sessions SET paid = 1, email = ? WHERE session_id = ?",
-                (email, session_id)
-            )
-            conn.commit()
+        email = (session.get('customer_details') or {}).get('email')
+        image_id = (session.get('metadata') or {}).get('image_id')
+        row = confirm_paid_session(session_id, image_id, email)
+        if row:
+            image_id = image_id or row['image_id']
         print(f"✅ Payment confirmed for session: {session_id}")
 
+        # Start generating now instead of waiting for the browser redirect
+        paid = session.get('payment_status') in ('paid', 'no_payment_required')
+        if image_id and paid and not (row and row['used']):
+            job = enqueue_video_job(session_id, image_id)
+            if not job['success']:
+                print(f"⚠️ Could not start job from webhook for {session_id}: {job['error']}")
+
     return jsonify({'success': True})
 
 @app.route('/check-payment/<session_id>')
 def check_payment(session_id):
     """Check if payment has been completed"""
-    with get_db() as conn:
-        row = conn.execute(
-            "SELECT paid FROM sessions WHERE session_id = ?", (session_id,)
-        ).fetchone()
+    row = load_session(session_id)
     if row and row['paid']:
         return jsonify({'success': True, 'paid': True})
     return jsonify({'success': True, 'paid': False})
@@ -608,70 +1441,25 @@ def generate_video_endpoint():
         return jsonify({'success': False, 'error': 'Failed to verify payment'}), 500
 
     # Upsert session record
-    with get_db() as conn:
-        existing = conn.execute(
-            "SELECT used, image_id FROM sessions WHERE session_id = ?", (session_id,)
-        ).fetchone()
-
-        if existing:
-            if existing['used']:
-                return jsonify({'success': False, 'error': 'Payment already used'}), 402
-            if not image_id:
-                image_id = existing['image_id']
-            conn.execute(
-                "UPDATE sessions SET paid = 1 WHERE session_id = ?", (session_id,)
-            )
-        else:
-            if not image_id:
-                return jsonify({'success': False, 'error': 'No image found for this session'}), 400
-            conn.execute(
-                "INSERT INTO sessions (session_id, paid, image_id, created_at) VALUES (?, 1, ?, ?)",
-                (session_id, image_id, time.time())
-            )
-        conn.commit()
+    image_id, used, done = upsert_paid_session(session_id, image_id)
+    if used:
+        if done:
+            return jsonify({'success': True, 'job_id': done['job_id'], 'status': done['status']})
+        return jsonify({'success': False, 'error': 'Payment already used'}), 402
 
     if not image_id:
         return jsonify({'success': False, 'error': 'No image found for this session'}), 400
 
-    # Find the uploaded image file
-    import glob as glob_module
-    image_files = glob_module.glob(os.path.join(app.config['UPLOAD_FOLDER'], f"{image_id}.*"))
-
-    if not image_files:
-        all_files = os.listdir(app.config['UPLOAD_FOLDER'])
-        print(f"📁 All files in upload folder: {all_files}")
-        return jsonify({'success': False, 'error': f'Image file not found. Image ID: {image_id}'}), 404
-
-    filepath = image_files[0]
-    filename = os.path.basename(filepath)
-
-    # Create a job record
-    job_id = str(uuid.uuid4())
-    with get_db() as conn:
-        conn.execute(
-            "INSERT INTO jobs (job_id, session_id, status, created_at, updated_at) VALUES (?, ?, 'processing', ?, ?)",
-            (job_id, session_id, time.time(), time.time())
-        )
-        conn.commit()
-
-    # Start background thread — does not block this request
-    thread = threading.Thread(
-        target=run_video_job,
-        args=(job_id, filepath, filename, session_id),
-        daemon=True
-    )
-    thread.start()
+    job = enqueue_video_job(session_id, image_id)
+    if not job['success']:
+        return jsonify({'success': False, 'error': job['error']}), job['status_code']
 
-    print(f"🚀 Job {job_id} started for session {session_id}")
-    return jsonify({'success': True, 'job_id': job_id, 'status': 'processing'})
+    return jsonify({'success': True, 'job_id': job['job_id'], 'status': job['status']})
 
 @app.route('/job-status/<job_id>')
 def job_status(job_id):
     """Poll endpoint: returns current status of a video generation job"""
-    with get_db() as conn:
-        row = conn.execute(
-            "SELECT * FROM jobs WHERE job_id = ?", (job_id,)
-        ).fetchone()
+    row = load_job(job_id)
 
     if not row:
         return jsonify({'success': False, 'error': 'Job not found'}), 404
@@ -689,6 +1477,8 @@ def job_status(job_id):
         result['spotify_video'] = row['spotify_video']
         result['apple_square_video'] = row['apple_square_video']
         result['apple_portrait_video'] = row['apple_portrait_video']
+        if row['encode_stats']:
+            result['encode_stats'] = json.loads(row['encode_stats'])
         if row['error']:
             result['processing_error'] = row['error']
     elif row['status'] == 'failed':
@@ -696,22 +1486,28 @@ def job_status(job_id):
 
     return jsonify(result)
 
+def send_result(filename, as_attachment):
+    """Serve a finished video from storage — redirect to the object store when possible"""
+    if not storage.exists('results', filename):
+        return jsonify({'success': False, 'error': 'File not found'}), 404
+    url = storage.url('results', filename, download=as_attachment)
+    if url:
+        return redirect(url)
+    filepath = storage.local_path('results', filename, app.config['RESULT_FOLDER'])
+    if as_attachment:
+        return send_file(filepath, as_attachment=True)
+    return send_file(filepath, mimetype='video/mp4')
+
 @app.route('/download/<filename>')
 def download_result(filename):
     """Download the generated video"""
-    filepath = os.path.join(app.config['RESULT_FOLDER'], filename)
-    if os.path.exists(filepath):
-        return send_file(filepath, as_attachment=True)
-    return jsonify({'success': False, 'error': 'File not found'}), 404
+    return send_result(filename, as_attachment=True)
 
 @app.route('/preview/<filename>')
 def preview_video(filename):
     """Preview the generated video"""
-    filepath = os.path.join(app.config['RESULT_FOLDER'], filename)
-    print(f"🎥 Preview request for: {filename} (exists: {os.path.exists(filepath)})")
-    if os.path.exists(filepath):
-        return send_file(filepath, mimetype='video/mp4')
-    return jsonify({'success': False, 'error': 'File not found'}), 404
+    print(f"🎥 Preview request for: {filename}")
+    return send_result(filename, as_attachment=False)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
@@ -0,0 +1,230 @@
+"""
+Storage and database backends for Covertify.
+
+File storage:
+- FileStorage: local folders (default — uploads/ and Result/ or the Railway volume)
+- S3Storage: any S3-compatible object store (AWS S3, Cloudflare R2, MinIO)
+
+Job/session database:
+- SQLite file (default, single replica) — handled directly in app.py
+- PostgresPool / PostgresConnection: networked database so several web and
+  worker replicas can share sessions and claim jobs atomically
+
+Selected with STORAGE_BACKEND and DATABASE_URL, see app.py.
+"""
+import os
+import shutil
+import threading
+
+try:
+    import boto3
+except ImportError:  # only needed for STORAGE_BACKEND=s3
+    boto3 = None
+
+try:
+    import psycopg2
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:  # only needed when DATABASE_URL is set
+    psycopg2 = None
+
+
+# --- File storage ---
+# Files live in two namespaces: 'uploads' (source images) and 'results' (videos).
+
+class FileStorage:
+    """Stores files in local folders, one per namespace."""
+
+    is_local = True
+
+    def __init__(self, folders):
+        self.folders = folders
+        for folder in folders.values():
+            os.makedirs(folder, exist_ok=True)
+
+    def path(self, namespace, name):
+        return os.path.join(self.folders[namespace], name)
+
+    def put(self, namespace, local_path):
+        """Store local_path under its basename. Takes ownership of local_path."""
+        name = os.path.basename(local_path)
+        dest = self.path(namespace, name)
+        if os.path.abspath(local_path) != os.path.abspath(dest):
+            shutil.move(local_path, dest)
+        return name
+
+    def local_path(self, namespace, name, scratch_folder=None):
+        """Return a local path for name (already local for this backend)."""
+        return self.path(namespace, name)
+
+    def exists(self, namespace, name):
+        return os.path.exists(self.path(namespace, name))
+
+    def find(self, namespace, prefix):
+        """Return names in namespace starting with prefix"""
+        return sorted(f for f in os.listdir(self.folders[namespace]) if f.startswith(prefix))
+
+    def url(self, namespace, name, download=False):
+        """Direct URL for the file, or None when it must be served by the app."""
+        return None
+
+    def public_origin(self):
+        return None
+
+
+class S3Storage:
+    """Stores files in an S3-compatible bucket under <prefix><namespace>/<name>.
+
+    Local copies are kept only while a job needs them; downloads and previews are
+    served from presigned URLs so video bytes never pass through the web workers.
+    """
+
+    is_local = False
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, url_expiry=3600):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.url_expiry = url_expiry
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+
+    def key(self, namespace, name):
+        return f"{self.prefix}{namespace}/{name}"
+
+    def put(self, namespace, local_path):
+        """Upload local_path under its basename and delete the local copy."""
+        name = os.path.basename(local_path)
+        self.client.upload_file(local_path, self.bucket, self.key(namespace, name))
+        os.remove(local_path)
+        return name
+
+    def local_path(self, namespace, name, scratch_folder):
+        """Download name into scratch_folder (if not already there) and return the path."""
+        dest = os.path.join(scratch_folder, name)
+        if not os.path.exists(dest):
+            os.makedirs(scratch_folder, exist_ok=True)
+            self.client.download_file(self.bucket, self.key(namespace, name), dest)
+        return dest
+
+    def exists(self, namespace, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(namespace, name))
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def find(self, namespace, prefix):
+        key_prefix = self.key(namespace, '')
+        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=key_prefix + prefix)
+        return sorted(obj['Key'][len(key_prefix):] for obj in response.get('Contents', []))
+
+    def url(self, namespace, name, download=False):
+        params = {'Bucket': self.bucket, 'Key': self.key(namespace, name)}
+        if download:
+            params['ResponseContentDisposition'] = f'attachment; filename="{name}"'
+        else:
+            params['ResponseContentType'] = 'video/mp4'
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=self.url_expiry)
+
+    def public_origin(self):
+        """Origin presigned URLs point at — needed in the CSP media-src."""
+        from urllib.parse import urlparse
+        url = urlparse(self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': 'probe'}, ExpiresIn=60
+        ))
+        return f"{url.scheme}://{url.netloc}"
+
+
+# --- Networked database ---
+
+def to_pyformat(sql):
+    """Translate sqlite '?' placeholders to psycopg2's '%s'.
+
+    '?' inside quoted literals or identifiers is left alone, and every '%' is
+    doubled, since psycopg2 treats '%' as a format character anywhere in the query.
+    """
+    out = []
+    quote = None
+    for ch in sql:
+        if quote:
+            if ch == quote:
+                quote = None  # a doubled quote just re-opens on the next char
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == '?':
+            out.append('%s')
+            continue
+        out.append('%%' if ch == '%' else ch)
+    return ''.join(out)
+
+
+class PostgresPool:
+    """Process-wide pool of psycopg2 connections.
+
+    Saves a TCP + auth handshake on every get_db(). getconn() blocks while all
+    `size` connections are checked out instead of raising like psycopg2's pool.
+    """
+
+    def __init__(self, dsn, size):
+        if psycopg2 is None:
+            raise RuntimeError("DATABASE_URL requires psycopg2 (pip install psycopg2-binary)")
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            0, size, dsn, cursor_factory=psycopg2.extras.RealDictCursor
+        )
+        self._slots = threading.BoundedSemaphore(size)
+
+    def getconn(self):
+        self._slots.acquire()
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        """Return conn to the pool; broken connections are closed instead."""
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def connection(self):
+        return PostgresConnection(self)
+
+
+class PostgresConnection:
+    """Pooled psycopg2 connection with the subset of the sqlite3 API that app.py uses.
+
+    Queries keep sqlite's '?' placeholders and rows support row['column'], so the
+    same SQL runs on both. Used as `with get_db() as conn:` it commits on success
+    and rolls back on error, like sqlite3, then goes back to the pool.
+    """
+
+    dialect = 'postgres'
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = pool.getconn()
+
+    def execute(self, sql, params=()):
+        cursor = self._conn.cursor()
+        cursor.execute(to_pyformat(sql), params)
+        return cursor
+
+    def commit(self):
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        finally:
+            self._pool.putconn(self._conn)
+        return False
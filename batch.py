@@ -0,0 +1,263 @@
+"""
+Batch cover processing from a directory or manifest.
+
+Runs the same pipeline as the web app (generate_video -> download_video ->
+process_for_platforms) for many covers at once. Runway generations and ffmpeg
+encodes run concurrently under separate limits, items already marked
+succeeded in the results manifest are skipped, so an interrupted batch can
+simply be re-run. Items whose video was already generated (but not encoded)
+reuse it instead of paying for a new Runway generation.
+
+Input:
+    - a directory of images, or
+    - a .csv with an `image` column, or a .jsonl with one {"image": ...} per line.
+      Optional fields: `id` (defaults to the image file name) and `prompt`.
+      Relative image paths are resolved against the manifest's folder.
+
+Usage:
+    python3 batch.py covers/ --out Result/label-drop
+    python3 batch.py covers.csv --generate-workers 4 --encode-workers 2
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.utils import secure_filename
+
+import app as covertify
+
+DEFAULT_PROMPT = 'Subtle cinematic motion, slow and small zoom in, high quality, no text'
+RESULTS_MANIFEST = 'results.jsonl'
+
+
+def load_items(source):
+    """Return [{'id', 'image', 'prompt'}] from a directory, CSV or JSONL manifest"""
+    if os.path.isdir(source):
+        rows = [{'image': os.path.join(source, name)} for name in sorted(os.listdir(source))
+                if covertify.allowed_file(name)]
+        base_dir = source
+    else:
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, newline='') as f:
+            if source.lower().endswith('.csv'):
+                rows = list(csv.DictReader(f))
+            elif source.lower().endswith('.jsonl'):
+                rows = [json.loads(line) for line in f if line.strip()]
+            else:
+                raise ValueError(f"Unsupported manifest type: {source} (use a directory, .csv or .jsonl)")
+
+    items = []
+    seen = set()
+    for row in rows:
+        image = row.get('image')
+        if not image:
+            raise ValueError(f"Manifest row without an image: {row}")
+        image = os.path.join(base_dir, image) if not os.path.isabs(image) else image
+        raw_id = row.get('id') or os.path.splitext(os.path.basename(image))[0]
+        # ids become file names in the output folder — no separators or '..'
+        item_id = secure_filename(str(raw_id))
+        if not item_id:
+            raise ValueError(f"Invalid item id: {raw_id!r}")
+        if item_id in seen:
+            raise ValueError(f"Duplicate item id: {item_id}")
+        seen.add(item_id)
+        items.append({'id': item_id, 'image': image, 'prompt': row.get('prompt') or DEFAULT_PROMPT})
+    return items
+
+
+def load_state(results_path):
+    """Return {id: merged record} from an existing results manifest.
+
+    Records for the same id are merged in order, so an item whose generation
+    finished but whose encode failed still carries its video_url and task_id.
+    """
+    state = {}
+    if os.path.exists(results_path):
+        with open(results_path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    state.setdefault(record['id'], {}).update(record)
+    return state
+
+
+class BatchRunner:
+    """Two-stage pipeline: a generation pool feeding an encode pool"""
+
+    def __init__(self, out_dir, generate_workers, encode_workers):
+        self.out_dir = out_dir
+        self.inputs_dir = os.path.join(out_dir, '_inputs')
+        self.results_path = os.path.join(out_dir, RESULTS_MANIFEST)
+        self.generate_pool = ThreadPoolExecutor(generate_workers, thread_name_prefix='generate')
+        self.encode_pool = ThreadPoolExecutor(encode_workers, thread_name_prefix='encode')
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.done = threading.Condition(self.lock)
+        self.counts = {'succeeded': 0, 'failed': 0}
+
+    def append_record(self, record):
+        """Checkpoint progress without finishing the item"""
+        with self.lock:
+            with open(self.results_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def write_result(self, record):
+        with self.lock:
+            with open(self.results_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+            self.counts[record['status']] += 1
+            self.pending -= 1
+            self.done.notify_all()
+        icon = '✅' if record['status'] == 'succeeded' else '❌'
+        print(f"{icon} {record['id']}: {record['status']}{' — ' + record['error'] if record.get('error') else ''}")
+
+    def prepare_image(self, item):
+        """Validate the image and return a path Runway accepts (HEIC is converted on a copy)"""
+        image = item['image']
+        if not os.path.exists(image):
+            raise FileNotFoundError(f"Image not found: {image}")
+        if os.path.splitext(image)[1].lower() in ('.heic', '.heif'):
+            os.makedirs(self.inputs_dir, exist_ok=True)
+            copy = os.path.join(self.inputs_dir, f"{item['id']}{os.path.splitext(image)[1].lower()}")
+            shutil.copyfile(image, copy)
+            image = covertify.convert_heic_to_jpeg(copy)
+        is_valid, message = covertify.validate_image_format(image)
+        if not is_valid:
+            raise ValueError(message)
+        return image
+
+    def generate(self, item):
+        record = {'id': item['id'], 'image': item['image'], 'started_at': time.time()}
+        try:
+            image = self.prepare_image(item)
+            started = time.time()
+            result = covertify.generate_video(image, item['prompt'], duration=5)
+            record['generate_seconds'] = round(time.time() - started, 2)
+            if not result['success']:
+                raise RuntimeError(result['error'])
+            record['video_url'] = result['video_url']
+            record['task_id'] = result['task_id']
+            # Checkpoint now so a re-run after a failed encode doesn't pay for a new generation
+            self.append_record(dict(record, status='generated'))
+        except Exception as e:
+            record.update(status='failed', error=str(e))
+            self.write_result(record)
+            return
+        self.encode_pool.submit(self.encode, item, record)
+
+    def encode(self, item, record):
+        try:
+            video_filename = f"{item['id']}_generated.mp4"
+            video_path = os.path.join(self.out_dir, video_filename)
+            if record.get('original_video') == video_filename and os.path.exists(video_path):
+                print(f"♻️ {item['id']}: reusing downloaded {video_filename}")
+            else:
+                started = time.time()
+                try:
+                    video_path = covertify.download_video(record['video_url'], video_filename)
+                except requests.HTTPError as e:
+                    status = e.response.status_code if e.response is not None else None
+                    if status and 400 <= status < 500:
+                        # Runway output URLs expire — forget this one so the next run regenerates
+                        record['video_url'] = None
+                        raise RuntimeError(f"Generated video is no longer available (HTTP {status}), "
+                                           f"it will be regenerated on the next run")
+                    raise
+                record['download_seconds'] = round(time.time() - started, 2)
+                record['original_video'] = video_filename
+                self.append_record(dict(record, status='downloaded'))
+
+            started = time.time()
+            process_result = covertify.process_for_platforms(video_path)
+            record['encode_seconds'] = round(time.time() - started, 2)
+            if not process_result['success']:
+                raise RuntimeError(process_result['error'])
+
+            record.update(
+                status='succeeded',
+                files=process_result['files'],
+                encode_stats=process_result['stats'],
+            )
+        except Exception as e:
+            record.update(status='failed', error=str(e))
+        record['total_seconds'] = round(time.time() - record['started_at'], 2)
+        self.write_result(record)
+
+    def run(self, items, state=None):
+        """Process items; those with a generated video in state skip straight to encoding"""
+        state = state or {}
+        with self.lock:
+            self.pending = len(items)
+        for item in items:
+            previous = state.get(item['id'], {})
+            if previous.get('video_url'):
+                print(f"♻️ {item['id']}: already generated (task {previous.get('task_id')}), encoding only")
+                record = {key: previous[key] for key in ('id', 'image', 'video_url', 'task_id', 'original_video')
+                          if key in previous}
+                record['started_at'] = time.time()
+                self.encode_pool.submit(self.encode, item, record)
+            else:
+                self.generate_pool.submit(self.generate, item)
+        with self.lock:
+            while self.pending:
+                self.done.wait()
+        self.generate_pool.shutdown()
+        self.encode_pool.shutdown()
+        return self.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate motion covers for many images at once')
+    parser.add_argument('source', help='Directory of images, or a .csv/.jsonl manifest')
+    parser.add_argument('--out', default=None, help='Output folder (default: the app Result folder)')
+    parser.add_argument('--generate-workers', type=int, default=covertify.RUNWAY_MAX_CONCURRENT,
+                        help='Concurrent Runway generations, capped at RUNWAY_MAX_CONCURRENT (the default)')
+    parser.add_argument('--encode-workers', type=int, default=1,
+                        help='Concurrent ffmpeg pipelines, each with an equal share of FFMPEG_THREAD_BUDGET')
+    args = parser.parse_args()
+
+    # The app splits Runway and encoder limits across web workers (RUNWAY_PROCESSES,
+    # FFMPEG_PROCESSES). This process takes the whole account limit and thread budget
+    # instead — lower them for the run if the web tier is generating at the same time.
+    if args.generate_workers > covertify.RUNWAY_MAX_CONCURRENT:
+        print(f"⚠️ --generate-workers {args.generate_workers} is above RUNWAY_MAX_CONCURRENT="
+              f"{covertify.RUNWAY_MAX_CONCURRENT}: extra generations will queue")
+    covertify.runway_governor = covertify.build_runway_governor(
+        1, min(args.generate_workers, covertify.RUNWAY_MAX_CONCURRENT)
+    )
+    covertify.ffmpeg_budget = covertify.ThreadBudget(covertify.FFMPEG_THREAD_BUDGET, args.encode_workers)
+
+    out_dir = os.path.abspath(args.out or covertify.app.config['RESULT_FOLDER'])
+    os.makedirs(out_dir, exist_ok=True)
+    # download_video and process_for_platforms write into RESULT_FOLDER
+    covertify.app.config['RESULT_FOLDER'] = out_dir
+
+    try:
+        items = load_items(args.source)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    state = load_state(os.path.join(out_dir, RESULTS_MANIFEST))
+    todo = [item for item in items if state.get(item['id'], {}).get('status') != 'succeeded']
+    print(f"📋 {len(items)} item(s), {len(items) - len(todo)} already done, {len(todo)} to process -> {out_dir}")
+    if not todo:
+        return
+
+    started = time.time()
+    counts = BatchRunner(out_dir, args.generate_workers, args.encode_workers).run(todo, state)
+    print(f"🚀 DONE in {time.time() - started:.0f}s: {counts['succeeded']} succeeded, {counts['failed']} failed. "
+          f"Results: {os.path.join(out_dir, RESULTS_MANIFEST)}")
+    if counts['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
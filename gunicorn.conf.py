@@ -0,0 +1,14 @@
+# Gunicorn settings shared by Procfile, railway.json and nixpacks.toml
+# Override any of these with the matching env var.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+timeout = int(os.environ.get('WEB_TIMEOUT', 600))
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# gevent (default): each worker serves many connections cooperatively, so large
+# video downloads and status polling don't tie up a whole worker.
+# Set WEB_WORKER_CLASS=sync to go back to one request per worker.
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000))
+threads = int(os.environ.get('WEB_THREADS', 1))  # only used by the gthread worker
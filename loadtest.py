@@ -0,0 +1,103 @@
+"""
+Connection-capacity load test for the web tier.
+
+Holds N slow video downloads open (reading a few KB per second, like a
+customer on a bad connection) and measures landing-page latency while
+they are held. With sync workers the page stalls once every worker is
+busy streaming; with the gevent worker it should stay flat.
+
+Usage:
+    # terminal 1
+    WEB_WORKER_CLASS=gevent ./run_local.sh      # or WEB_WORKER_CLASS=sync
+    # terminal 2 — needs a finished video in the Result folder
+    python3 loadtest.py --file <name>_apple_square.mp4 --downloads 50
+"""
+import argparse
+import statistics
+import threading
+import time
+import http.client
+from urllib.parse import urlparse
+
+
+def slow_download(host, port, path, stop, stats):
+    """Open a download and trickle-read it until told to stop"""
+    try:
+        conn = http.client.HTTPConnection(host, port, timeout=60)
+        conn.request('GET', path)
+        response = conn.getresponse()
+        with stats['lock']:
+            stats['opened'] += 1
+        while not stop.is_set():
+            if not response.read(4096):
+                break
+            time.sleep(0.5)
+        conn.close()
+    except Exception as e:
+        with stats['lock']:
+            stats['errors'] += 1
+        print(f"⚠️ Download connection failed: {e}")
+
+
+def time_request(host, port, path, timeout=10):
+    """Return seconds for one full GET, or None on error/timeout"""
+    started = time.time()
+    try:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        conn.request('GET', path)
+        conn.getresponse().read()
+        conn.close()
+    except Exception:
+        return None
+    return time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hold slow downloads open and measure page latency')
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--file', required=True, help='Filename in the Result folder to download')
+    parser.add_argument('--downloads', type=int, default=20, help='Concurrent slow downloads to hold')
+    parser.add_argument('--probes', type=int, default=20, help='Landing-page requests to time')
+    parser.add_argument('--warmup', type=float, default=5, help='Seconds to let downloads connect before probing')
+    parser.add_argument('--probe-timeout', type=float, default=10, help='Seconds before a page request counts as failed')
+    args = parser.parse_args()
+
+    url = urlparse(args.url)
+    host, port = url.hostname, url.port or 80
+
+    baseline = [t for t in (time_request(host, port, '/') for _ in range(5)) if t is not None]
+    print(f"📊 Baseline page latency: {statistics.median(baseline) * 1000:.0f} ms (median of {len(baseline)})")
+
+    stop = threading.Event()
+    stats = {'opened': 0, 'errors': 0, 'lock': threading.Lock()}
+    downloads = [
+        threading.Thread(target=slow_download, args=(host, port, f"/download/{args.file}", stop, stats), daemon=True)
+        for _ in range(args.downloads)
+    ]
+    for t in downloads:
+        t.start()
+    time.sleep(args.warmup)
+    print(f"⏳ Holding {stats['opened']}/{args.downloads} downloads open ({stats['errors']} errors)")
+
+    latencies = []
+    failures = 0
+    for _ in range(args.probes):
+        t = time_request(host, port, '/', args.probe_timeout)
+        if t is None:
+            failures += 1
+        else:
+            latencies.append(t)
+        time.sleep(0.1)
+
+    stop.set()
+
+    if latencies:
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"📊 Page latency under load: median {statistics.median(latencies) * 1000:.0f} ms, "
+              f"p95 {p95 * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms")
+    print(f"❌ Failed/timed-out page requests: {failures}/{args.probes}")
+
+
+if __name__ == '__main__':
+    main()
@@ -20,13 +20,10 @@ export PORT=8080
 
 echo "🚀 Starting Covertify locally on http://localhost:8080"
 echo "   LOCAL_DEV=true (HTTPS enforcement disabled)"
-echo "   Workers: 2 | Threads: 4 per worker"
+echo "   Workers: 2 | Worker class: ${WEB_WORKER_CLASS:-gevent}"
 echo ""
 
 source venv/bin/activate
 gunicorn app:app \
-    --bind 0.0.0.0:$PORT \
-    --workers 2 \
-    --threads 4 \
-    --timeout 600 \
+    --config gunicorn.conf.py \
     --log-level info
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# app.py reads its config at import time — point it at throwaway state first
+_tmp = tempfile.mkdtemp(prefix='covertify-tests-')
+os.environ.setdefault('RUNWAYML_API_SECRET', 'test')
+os.environ['LOCAL_DEV'] = 'true'
+os.environ['SQLITE_PATH'] = os.path.join(_tmp, 'covertify.db')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
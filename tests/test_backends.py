@@ -0,0 +1,76 @@
+import os
+import uuid
+
+import pytest
+
+from backends import FileStorage, PostgresPool, S3Storage, to_pyformat
+
+
+def test_to_pyformat_leaves_literals_alone():
+    sql = "SELECT '?', 'it''s ?', \"col?\" FROM t WHERE a = ? AND b LIKE '50%' AND c = ?"
+    assert to_pyformat(sql) == (
+        "SELECT '?', 'it''s ?', \"col?\" FROM t WHERE a = %s AND b LIKE '50%%' AND c = %s"
+    )
+
+
+def storage_roundtrip(storage, scratch):
+    image_id = uuid.uuid4().hex
+    src = scratch / f"{image_id}.jpg"
+    src.write_bytes(b'cover')
+
+    assert storage.put('uploads', str(src)) == f"{image_id}.jpg"
+    assert storage.find('uploads', f"{image_id}.") == [f"{image_id}.jpg"]
+    assert storage.find('uploads', 'missing.') == []
+    assert storage.exists('uploads', f"{image_id}.jpg")
+    assert not storage.exists('results', f"{image_id}.jpg")
+
+    local = storage.local_path('uploads', f"{image_id}.jpg", str(scratch / 'fetched'))
+    with open(local, 'rb') as f:
+        assert f.read() == b'cover'
+
+
+def test_file_storage(tmp_path):
+    storage = FileStorage({'uploads': str(tmp_path / 'uploads'), 'results': str(tmp_path / 'results')})
+    storage_roundtrip(storage, tmp_path)
+    assert storage.url('uploads', 'x.jpg') is None
+
+
+@pytest.fixture
+def s3_storage():
+    """S3Storage against a local MinIO (or other S3 stand-in) from TEST_S3_ENDPOINT_URL"""
+    endpoint = os.environ.get('TEST_S3_ENDPOINT_URL')
+    if not endpoint:
+        pytest.skip('set TEST_S3_ENDPOINT_URL (e.g. http://localhost:9000 for MinIO) to run')
+    bucket = os.environ.get('TEST_S3_BUCKET', 'covertify-test')
+    storage = S3Storage(bucket, prefix=f"test-{uuid.uuid4().hex[:8]}/", endpoint_url=endpoint,
+                        region=os.environ.get('S3_REGION', 'us-east-1'))
+    try:
+        storage.client.create_bucket(Bucket=bucket)
+    except storage.client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    return storage
+
+
+def test_s3_storage(s3_storage, tmp_path):
+    storage_roundtrip(s3_storage, tmp_path)
+    url = s3_storage.url('uploads', 'x.jpg', download=True)
+    assert url.startswith(s3_storage.public_origin())
+
+
+def test_postgres_pool_reuses_connections():
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip('set TEST_DATABASE_URL to run against Postgres')
+    pool = PostgresPool(url, 2)
+
+    with pool.connection() as conn:
+        first = conn.execute("SELECT pg_backend_pid() AS pid").fetchone()['pid']
+    with pool.connection() as conn:
+        assert conn.execute("SELECT pg_backend_pid() AS pid").fetchone()['pid'] == first
+
+    # A failed transaction is rolled back before the connection is reused
+    with pytest.raises(Exception):
+        with pool.connection() as conn:
+            conn.execute("SELECT no_such_column FROM pg_class")
+    with pool.connection() as conn:
+        assert conn.execute("SELECT 1 AS one").fetchone()['one'] == 1
@@ -0,0 +1,124 @@
+import json
+
+import pytest
+import requests
+
+import app
+import batch
+
+
+def write_manifest(tmp_path, rows):
+    path = tmp_path / 'covers.jsonl'
+    path.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+    return str(path)
+
+
+def test_ids_are_made_safe_for_file_names(tmp_path):
+    items = batch.load_items(write_manifest(tmp_path, [
+        {'image': 'a.jpg', 'id': '../escape'},
+        {'image': 'b.jpg', 'id': 'label/drop 1'},
+    ]))
+    assert [item['id'] for item in items] == ['escape', 'label_drop_1']
+
+    with pytest.raises(ValueError):
+        batch.load_items(write_manifest(tmp_path, [{'image': 'a.jpg', 'id': '..'}]))
+
+
+def test_rerun_after_failed_encode_reuses_generated_video(tmp_path, monkeypatch):
+    (tmp_path / 'a.jpg').write_bytes(b'cover')
+    out = tmp_path / 'out'
+    out.mkdir()
+    monkeypatch.setitem(app.app.config, 'RESULT_FOLDER', str(out))
+
+    generations = []
+    downloads = []
+
+    def fake_generate(image, prompt, duration=5):
+        generations.append(image)
+        return {'success': True, 'video_url': 'https://runway/video.mp4', 'task_id': 'task-1'}
+
+    def fake_download(url, filename):
+        downloads.append(url)
+        path = out / filename
+        path.write_bytes(b'video')
+        return str(path)
+
+    encode_results = [
+        {'success': False, 'error': 'ffmpeg crashed'},
+        {'success': True, 'files': {'spotify': 'a_spotify.mp4'}, 'stats': {}},
+    ]
+    monkeypatch.setattr(app, 'validate_image_format', lambda path: (True, 'Valid image'))
+    monkeypatch.setattr(app, 'generate_video', fake_generate)
+    monkeypatch.setattr(app, 'download_video', fake_download)
+    monkeypatch.setattr(app, 'process_for_platforms', lambda path: encode_results.pop(0))
+
+    items = batch.load_items(str(tmp_path))
+    results = str(out / batch.RESULTS_MANIFEST)
+
+    first = batch.BatchRunner(str(out), 1, 1).run(items, batch.load_state(results))
+    assert first == {'succeeded': 0, 'failed': 1}
+
+    second = batch.BatchRunner(str(out), 1, 1).run(items, batch.load_state(results))
+    assert second == {'succeeded': 1, 'failed': 0}
+
+    assert len(generations) == 1  # Runway was only paid once
+    assert len(downloads) == 1  # and the downloaded video was reused
+    assert batch.load_state(results)['a']['status'] == 'succeeded'
+
+
+def test_expired_video_url_is_regenerated_on_the_next_run(tmp_path, monkeypatch):
+    (tmp_path / 'a.jpg').write_bytes(b'cover')
+    out = tmp_path / 'out'
+    out.mkdir()
+    monkeypatch.setitem(app.app.config, 'RESULT_FOLDER', str(out))
+    results = out / batch.RESULTS_MANIFEST
+    results.write_text(json.dumps({'id': 'a', 'status': 'generated', 'video_url': 'https://runway/old.mp4'}) + '\n')
+
+    generations = []
+
+    def fake_generate(image, prompt, duration=5):
+        generations.append(image)
+        return {'success': True, 'video_url': 'https://runway/new.mp4', 'task_id': 'task-2'}
+
+    def fake_download(url, filename):
+        if url.endswith('old.mp4'):
+            response = requests.Response()
+            response.status_code = 403
+            raise requests.HTTPError('403 Forbidden', response=response)
+        path = out / filename
+        path.write_bytes(b'video')
+        return str(path)
+
+    monkeypatch.setattr(app, 'validate_image_format', lambda path: (True, 'Valid image'))
+    monkeypatch.setattr(app, 'generate_video', fake_generate)
+    monkeypatch.setattr(app, 'download_video', fake_download)
+    monkeypatch.setattr(app, 'process_for_platforms',
+                        lambda path: {'success': True, 'files': {}, 'stats': {}})
+
+    items = batch.load_items(str(tmp_path))
+    first = batch.BatchRunner(str(out), 1, 1).run(items, batch.load_state(str(results)))
+    assert first == {'succeeded': 0, 'failed': 1}
+    assert generations == []
+    assert batch.load_state(str(results))['a']['video_url'] is None
+
+    second = batch.BatchRunner(str(out), 1, 1).run(items, batch.load_state(str(results)))
+    assert second == {'succeeded': 1, 'failed': 0}
+    assert len(generations) == 1
+
+
+def test_cli_sizes_limits_for_this_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'RUNWAY_MAX_CONCURRENT', 4)
+    monkeypatch.setattr(app, 'FFMPEG_THREAD_BUDGET', 6)
+    monkeypatch.setattr(app, 'runway_governor', app.runway_governor)
+    monkeypatch.setattr(app, 'ffmpeg_budget', app.ffmpeg_budget)
+    monkeypatch.setitem(app.app.config, 'RESULT_FOLDER', app.app.config['RESULT_FOLDER'])
+    empty = tmp_path / 'covers'
+    empty.mkdir()
+    monkeypatch.setattr('sys.argv', ['batch.py', str(empty), '--out', str(tmp_path / 'out'),
+                                     '--generate-workers', '3', '--encode-workers', '2'])
+
+    batch.main()
+
+    assert app.runway_governor.max_concurrent == 3
+    assert app.ffmpeg_budget.max_encodes == 2
+    assert app.ffmpeg_budget.threads == 3
@@ -0,0 +1,40 @@
+import threading
+import time
+
+import app
+
+
+def test_thread_budget_runs_encodes_side_by_side():
+    budget = app.ThreadBudget(8, 4)
+    started = []
+    peak = []
+    lock = threading.Lock()
+    release = threading.Event()
+
+    def encode():
+        with budget.slot() as threads:
+            with lock:
+                started.append(threads)
+                peak.append(budget.active)
+            release.wait(5)
+
+    threads = [threading.Thread(target=encode) for _ in range(5)]
+    for t in threads:
+        t.start()
+    deadline = time.time() + 5
+    while len(started) < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+
+    assert started == [2, 2, 2, 2]  # four at once, each with its share
+    assert budget.active == 4  # the fifth waits for a slot
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(started) == 5
+    assert max(peak) == 4
+
+
+def test_thread_budget_gives_each_encode_at_least_one_thread():
+    assert app.ThreadBudget(2, 4).threads == 1
+    assert app.ThreadBudget(7, 2).threads == 3
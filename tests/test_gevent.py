@@ -0,0 +1,69 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+pytest.importorskip('gevent')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter: monkey-patching has to happen before anything is imported
+SCRIPT = textwrap.dedent('''
+    from gevent import monkey
+    monkey.patch_all()
+
+    import json
+    import os
+    import sys
+    import time
+
+    import gevent
+
+    sys.path.insert(0, sys.argv[1])
+    import app
+    from backends import FileStorage
+
+    scratch = sys.argv[2]
+    app.storage = FileStorage({'uploads': os.path.join(scratch, 'uploads'), 'results': os.path.join(scratch, 'results')})
+    open(os.path.join(scratch, 'uploads', 'img.jpg'), 'wb').close()
+
+    def call(fn, *args):
+        try:
+            fn(*args)
+            return None
+        except Exception as e:
+            return repr(e)
+
+    started = time.time()
+    greenlets = [gevent.spawn(call, app.check_upload_rate, f"10.0.0.{i}") for i in range(30)]
+    greenlets += [gevent.spawn(call, app.enqueue_video_job, f"cs_{i % 10}", 'img') for i in range(30)]
+    gevent.joinall(greenlets)
+
+    with app.get_db() as conn:
+        jobs = conn.execute("SELECT COUNT(*) AS n FROM jobs").fetchone()['n']
+    print(json.dumps({
+        'gevent': app.is_gevent_worker(),
+        'errors': [g.value for g in greenlets if g.value],
+        'seconds': time.time() - started,
+        'jobs': jobs,
+    }))
+''')
+
+
+def test_concurrent_transactions_under_gevent_do_not_deadlock(tmp_path):
+    env = dict(os.environ, SQLITE_PATH=str(tmp_path / 'gevent.db'), JOB_RUNNER='queue')
+    (tmp_path / 'uploads').mkdir()
+    proc = subprocess.run(
+        [sys.executable, '-c', SCRIPT, ROOT, str(tmp_path)],
+        env=env, capture_output=True, text=True, timeout=60,
+    )
+    assert proc.returncode == 0, proc.stderr
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    assert result['gevent']
+    assert result['errors'] == []
+    assert result['jobs'] == 10  # one job per session
+    assert result['seconds'] < 5  # SQLite's busy timeout is 5s: a deadlock would hit it
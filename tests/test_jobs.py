@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+import app
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def db(request, monkeypatch, tmp_path):
+    """Fresh job database: SQLite always, Postgres when TEST_DATABASE_URL is set"""
+    if request.param == 'postgres':
+        url = os.environ.get('TEST_DATABASE_URL')
+        if not url:
+            pytest.skip('set TEST_DATABASE_URL to run against Postgres')
+        monkeypatch.setattr(app, 'DB_DIALECT', 'postgres')
+        monkeypatch.setattr(app, 'DATABASE_URL', url)
+    else:
+        monkeypatch.setattr(app, 'DB_PATH', str(tmp_path / 'jobs.db'))
+    app.init_db()
+    with app.get_db() as conn:
+        conn.execute("DELETE FROM jobs")
+        conn.commit()
+    return request.param
+
+
+def queue_jobs(count, created_at=None):
+    job_ids = []
+    with app.get_db() as conn:
+        for i in range(count):
+            job_id = str(uuid.uuid4())
+            conn.execute(
+                "INSERT INTO jobs (job_id, session_id, status, created_at, updated_at, image_name) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, f"cs_{i}", created_at or time.time() + i, time.time(), f"{i}.jpg")
+            )
+            job_ids.append(job_id)
+        conn.commit()
+    return job_ids
+
+
+def test_each_job_is_claimed_exactly_once(db):
+    job_ids = queue_jobs(30)
+    claimed = []
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        while True:
+            job = app.claim_next_job(worker_id)
+            if job is None:
+                return
+            with lock:
+                claimed.append(job['job_id'])
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(claimed) == sorted(job_ids)
+
+
+def test_claims_oldest_job_first(db):
+    job_ids = queue_jobs(3)
+    assert app.claim_next_job('w1')['job_id'] == job_ids[0]
+
+
+def test_stale_claim_is_reclaimed_and_old_worker_loses_it(db, monkeypatch):
+    [job_id] = queue_jobs(1)
+    assert app.claim_next_job('w1')['job_id'] == job_id
+    assert app.claim_next_job('w2') is None  # fresh claim is respected
+
+    with app.get_db() as conn:
+        conn.execute("UPDATE jobs SET claimed_at = ? WHERE job_id = ?",
+                     (time.time() - app.JOB_CLAIM_TIMEOUT - 1, job_id))
+        conn.commit()
+
+    assert app.claim_next_job('w2')['job_id'] == job_id
+    assert app.refresh_claim(job_id, 'w1') is False
+    assert app.refresh_claim(job_id, 'w2') is True
+
+
+def test_heartbeat_keeps_claim_fresh(db, monkeypatch):
+    monkeypatch.setattr(app, 'JOB_HEARTBEAT_INTERVAL', 0.05)
+    [job_id] = queue_jobs(1)
+    app.claim_next_job('w1')
+    with app.get_db() as conn:
+        conn.execute("UPDATE jobs SET claimed_at = 0 WHERE job_id = ?", (job_id,))
+        conn.commit()
+
+    stop = app.start_heartbeat(job_id, 'w1')
+    time.sleep(0.3)
+    stop.set()
+
+    assert app.claim_next_job('w2') is None
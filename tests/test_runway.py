@@ -0,0 +1,18 @@
+import app
+
+
+def test_governor_splits_account_limits_across_processes(monkeypatch):
+    monkeypatch.setattr(app, 'RUNWAY_REQUESTS_PER_SECOND', 2)
+    monkeypatch.setattr(app, 'RUNWAY_REQUEST_BURST', 6)
+    governor = app.build_runway_governor(2, max_concurrent=4)
+
+    assert governor.max_concurrent == 2
+    assert governor.bucket.rate == 1
+    assert governor.bucket.capacity == 3
+
+
+def test_governor_warns_when_processes_outnumber_slots(capsys):
+    governor = app.build_runway_governor(3, max_concurrent=1)
+
+    assert governor.max_concurrent == 1
+    assert 'RUNWAY_MAX_CONCURRENT=1 is less than RUNWAY_PROCESSES=3' in capsys.readouterr().out
@@ -0,0 +1,79 @@
+import io
+import threading
+
+import pytest
+from PIL import Image
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'DB_PATH', str(tmp_path / 'upload.db'))
+    app.init_db()
+    return app.app.test_client()
+
+
+def image_bytes(fmt, size=(300, 300), **save_args):
+    buf = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buf, fmt, **save_args)
+    buf.seek(0)
+    return buf
+
+
+def test_header_sniff_accepts_mpo_phone_jpegs():
+    mpo = image_bytes('MPO', save_all=True, append_images=[Image.new('RGB', (300, 300))])
+    assert app.sniff_image_header(mpo) == (True, 'MPO')
+    assert mpo.tell() == 0
+
+
+def test_header_sniff_rejects_small_and_non_images():
+    assert not app.sniff_image_header(image_bytes('PNG', size=(100, 100)))[0]
+    assert not app.sniff_image_header(io.BytesIO(b'not an image'))[0]
+
+
+def test_upload_rate_limit_is_shared_and_ignores_spoofed_forwarded_for(client, monkeypatch):
+    monkeypatch.setattr(app, 'TRUSTED_PROXY_HOPS', 0)
+    statuses = []
+    for i in range(app.UPLOAD_BURST + 1):
+        response = client.post(
+            '/upload-image',
+            data={'image': (io.BytesIO(b'x'), 'cover.txt')},
+            headers={'X-Forwarded-For': f"10.0.0.{i}"},
+        )
+        statuses.append(response.status_code)
+
+    assert statuses[:-1] == [400] * app.UPLOAD_BURST  # admitted, then rejected as bad file type
+    assert statuses[-1] == 429
+    assert 'Retry-After' in response.headers
+
+
+def test_upload_rate_admits_exactly_burst_under_concurrency(client):
+    results = []
+    lock = threading.Lock()
+
+    def take():
+        wait = app.check_upload_rate('10.9.9.9')
+        with lock:
+            results.append(wait)
+
+    threads = [threading.Thread(target=take) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results.count(0) == app.UPLOAD_BURST
+    assert all(0 < wait <= 60 / app.UPLOAD_RATE_PER_MINUTE for wait in results if wait)
+
+
+def test_upload_rate_refills_over_time(client, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'time', lambda: now[0])
+    for _ in range(app.UPLOAD_BURST):
+        assert app.check_upload_rate('10.8.8.8') == 0
+    assert app.check_upload_rate('10.8.8.8') > 0
+
+    now[0] += 60 / app.UPLOAD_RATE_PER_MINUTE  # one token's worth
+    assert app.check_upload_rate('10.8.8.8') == 0
+    assert app.check_upload_rate('10.8.8.8') > 0
@@ -0,0 +1,53 @@
+"""
+Job worker for JOB_RUNNER=queue deployments.
+
+Web replicas only record jobs as 'queued'; run one or more of these (on any
+node that shares DATABASE_URL and the S3 bucket) to claim and process them.
+
+Usage:
+    JOB_RUNNER=queue python3 worker.py
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+
+from app import claim_next_job, run_video_job
+
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 2))
+WORKER_POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', 2))
+
+
+def work_loop(worker_id):
+    """Claim and run jobs until the process exits"""
+    while True:
+        try:
+            job = claim_next_job(worker_id)
+        except Exception as e:
+            print(f"⚠️ {worker_id}: could not claim job: {e}")
+            job = None
+
+        if not job:
+            time.sleep(WORKER_POLL_INTERVAL)
+            continue
+
+        print(f"🛠️ {worker_id}: claimed job {job['job_id']}")
+        run_video_job(job['job_id'], job['image_name'], job['session_id'], worker_id=worker_id)
+
+
+def main():
+    host_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+    print(f"🚀 Worker {host_id} starting with {WORKER_CONCURRENCY} slot(s)")
+    threads = [
+        threading.Thread(target=work_loop, args=(f"{host_id}/{i}",), daemon=True)
+        for i in range(WORKER_CONCURRENCY)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+if __name__ == '__main__':
+    main()